@@ -193,7 +193,26 @@ setup_target() {
     echo "ip link set pfe2 up" > "${uart_dev}"
 }
 
+# Build the C receive loop used by can_to_eth_slow_path_m7.py. Without it the python
+# script falls back to a slower receive loop written in python.
+build_fast_recv_count() {
+    local src="fast_recv_count.c"
+    local lib="fast_recv_count.so"
+
+    if [ "${lib}" -nt "${src}" ]; then
+        return
+    fi
+    if ! command -v gcc > /dev/null; then
+        echo "gcc not found, packets will be received by the python loop"
+        return
+    fi
+    if ! gcc -O2 -shared -fPIC -o "${lib}" "${src}"; then
+        echo "Failed to build ${lib}, packets will be received by the python loop"
+    fi
+}
+
 run_test() {
+    build_fast_recv_count
     # Start the python script which receives the ethernet packets
     ip netns exec nw_ns0 python3 can_to_eth_slow_path_m7.py -l "${duration}" -log "${nw1_log}" -s "${payload_size}" -host-tcpip-port "${udp_port}"&
     pid=$!
@@ -216,6 +235,7 @@ display_results() {
     m7_1_core_load=$(sed -n -r 's/^M7_1 core load:\s+([0-9]+)/\1/p' "${nw0_log}")
     rx_frames=$(sed -n -r 's/^Rx frames:\s+(\w+)/\1/p' "${nw1_log}")
     rx_bytes=$(sed -n -r 's/^Rx data transfer:\s+([0-9]+)\s+bytes/\1/p' "${nw1_log}")
+    rx_path=$(sed -n -r 's/^Rx path:\s+(.*)/\1/p' "${nw1_log}")
     frames_lost=$((tx_frames - rx_frames))
     # Clear the log files
     rm -f "${nw1_log}" "${nw0_log}"
@@ -233,6 +253,7 @@ display_results() {
     echo "Rx throughput:            $((rx_bytes * 8 / ((duration * 1000)))) Kbit/s"
     echo "Lost frames:              ${frames_lost}"
     echo "Lost frames (%):          $((frames_lost * 100 / tx_frames)).$(((frames_lost * 100 - (frames_lost * 100 / tx_frames) * tx_frames) * 100 / tx_frames))%"
+    echo "Rx path:                  ${rx_path}"
     echo "M7_0 core load:           ${m7_0_core_load}"
     echo "M7_1 core load:           ${m7_1_core_load}"
     echo "#############################################################"
@@ -7,8 +7,12 @@ Copyright 2021-2022 NXP
 """
 
 import argparse
+import ctypes
+import os
 import socket
 
+from libc_socket import MMsgReceiver, load_fast_recv_count
+
 class M7CAN2ETHBenchmark():
     '''Actually runs the ethernet benchmark. It does this by creating and managing the
        socket through which the communication is done with the target.
@@ -31,6 +35,8 @@ class M7CAN2ETHBenchmark():
         self.__sock.bind((config.host_ip_eth, config.host_tcpip_port))
         self.__timeout = config.timeout
         self.__received_packets_eth = 0
+        # Which implementation received the packets, reported along with the results
+        self.__rx_path = None
 
         # synchronization variable for thread
         self.__run_receiver = False
@@ -38,14 +44,30 @@ class M7CAN2ETHBenchmark():
     def __receive_packets(self):
         '''Keep trying to receive packets until signaled by main thread to stop.
         '''
+        fast_recv_count = load_fast_recv_count()
+        if fast_recv_count:
+            # The whole receive loop runs in C, without taking the GIL for each packet. Like the
+            # python loop it stops once no packet arrives for the socket timeout.
+            received = fast_recv_count.count_until_timeout(
+                self.__sock.fileno(), self.__message_size, self.__sock.gettimeout())
+            self.__run_receiver = False
+            if received < 0:
+                # Receiving failed, the count is not a valid result
+                err = ctypes.get_errno()
+                raise OSError(err, os.strerror(err))
+            self.__received_packets_eth = received
+            self.__rx_path = "C loop (fast_recv_count.so)"
+            return
+
+        receiver = MMsgReceiver(self.__sock, self.__message_size)
         while self.__run_receiver:
             try:
-                self.__sock.recvfrom(self.__message_size)
-                self.__received_packets_eth += 1
+                self.__received_packets_eth += receiver.recv_batch()
             except socket.timeout:
                 # If a socket timeout occurs that means that the board does not send packets
                 # anymore and we can finish the thread
                 self.__run_receiver = False
+        self.__rx_path = "python loop (recvmmsg)" if receiver.batched else "python loop (recvfrom)"
 
     def print_test_results(self):
         '''Computes the benchmark metrics and writes them to output log(s) file(s)
@@ -59,6 +81,7 @@ class M7CAN2ETHBenchmark():
             out_fd.write(f"Rx data transfer:         {recv_data_transfer} bytes\n")
             out_fd.write(f"Rx frames/s:              {int(recv_packets / self.__timeout)}\n")
             out_fd.write(f"Rx throughput:            {bandwidth} Kbit/s\n")
+            out_fd.write(f"Rx path:                  {self.__rx_path}\n")
 
     def run_benchmark(self):
         '''Actually runs the benchmark. It spawns the sending/receiving threads and after this it
@@ -69,6 +92,7 @@ class M7CAN2ETHBenchmark():
         print("#############################################")
         self.__run_receiver = True
         self.__receive_packets()
+        print(f"Packets received by the {self.__rx_path}")
 
         self.__sock.close()
         print("Test has finished, getting results")
@@ -7,15 +7,41 @@ Copyright 2021 NXP
 """
 
 import argparse
-import ctypes
+import itertools
 import os
-import random
 import socket
-import string
 import threading
 import time
 
-libc = ctypes.CDLL('libc.so.6')
+from libc_socket import (MMsgSender, StreamSender, UDP_GSO_SEND_ERRORS, disable_udp_gso,
+                         enable_udp_gso, enable_zerocopy, libc, path_mtu, set_buffer_sizes)
+
+def cpu_list(value):
+    '''Parses a comma separated list of CPUs given on the command line.
+       :param value: the list of CPUs, e.g. 0,1,2,3
+       :return: the CPUs as a list of integers
+    '''
+    try:
+        cpus = [int(cpu) for cpu in value.split(',')]
+    except ValueError as err:
+        raise argparse.ArgumentTypeError(f'invalid CPU list {value}') from err
+    unavailable = set(cpus) - os.sched_getaffinity(0)
+    if unavailable:
+        raise argparse.ArgumentTypeError(f'CPUs {sorted(unavailable)} are not available')
+    return cpus
+
+def positive_int(value):
+    '''Parses a strictly positive integer given on the command line.
+       :param value: the integer as a string
+       :return: the integer
+    '''
+    try:
+        number = int(value)
+    except ValueError as err:
+        raise argparse.ArgumentTypeError(f'invalid integer {value}') from err
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'{value} must be at least 1')
+    return number
 
 def netns_socket(nsname, *args):
     '''Create the socket inside a network namespace.
@@ -92,69 +118,162 @@ class M7ETHBenchmark():
     BITS_IN_MBIT = 1000000
     UDP_HEADER_SIZE = 42
     TCP_HEADER_SIZE = 56
+    # Maps every byte value to a lowercase ASCII letter
+    LOWERCASE_TABLE = bytes(ord('a') + i % 26 for i in range(256))
     def __init__(self, config):
         '''
            :param config: the collection of parameters passed from command line
         '''
+        # A connected TCP socket can not share its address, so only UDP traffic can be spread
+        # over several receiving sockets
+        self.__rx_threads = 1 if config.conn_type == "TCP" else config.rx_threads
+        namespaces = [config.ns0, config.ns1]
+        host_ips = [config.host_ip_eth0, config.host_ip_eth1]
         self.__sock_ns = [ ]
-        #create the two sockets and set a timeout on them so that recv will return eventually
-        self.__sock_ns.append(netns_socket(config.ns0,socket.AF_INET,  # Internet
-                                           SOCKET_TYPE))
-        self.__sock_ns.append(netns_socket(config.ns1,socket.AF_INET,  # Internet
-                                           SOCKET_TYPE))
-        self.__sock_ns[0].settimeout(2.0)
-        self.__sock_ns[1].settimeout(2.0)
-        # Bind to interface
-
-        self.__sock_ns[0].bind((config.host_ip_eth0, config.host_tcpip_port))
-        self.__sock_ns[1].bind((config.host_ip_eth1, config.host_tcpip_port))
+        self.__rx_socks = [[ ], [ ]]
+        for idx in range(2):
+            #create the sockets and set a timeout on them so that recv will return eventually
+            for _ in range(self.__rx_threads):
+                sock = netns_socket(namespaces[idx], socket.AF_INET,  # Internet
+                                    SOCKET_TYPE)
+                sock.settimeout(2.0)
+                if SOCKET_TYPE == socket.SOCK_STREAM:
+                    self.__tune_tcp_socket(sock, config.sock_buf)
+                if self.__rx_threads > 1:
+                    # Let the sibling sockets bind to the same address, the kernel will
+                    # distribute the incoming flows between them
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+                # Bind to interface
+                sock.bind((host_ips[idx], config.host_tcpip_port))
+                self.__rx_socks[idx].append(sock)
+            # The first socket of each path is also used for sending
+            self.__sock_ns.append(self.__rx_socks[idx][0])
         #if the connection type is TCP connect to the target sockets and adjust the header size
+        self.__conn_type = config.conn_type
         if config.conn_type == "TCP":
             self.header_size = self.TCP_HEADER_SIZE
             self.__sock_ns[1].connect((config.board_ip_eth1, config.board_tcpip_port))
             self.__sock_ns[0].connect((config.board_ip_eth0, config.board_tcpip_port))
+            # The message buffer is never modified, so it can be sent without copying it
+            self.__zerocopy = config.zerocopy and all(
+                enable_zerocopy(sock) for sock in self.__sock_ns)
+            if config.zerocopy and not self.__zerocopy:
+                print("Zero copy is not supported by the kernel (SO_ZEROCOPY), "
+                      "sending with regular copies")
         else:
             self.header_size = self.UDP_HEADER_SIZE
+            self.__zerocopy = False
+            # Path MTU towards the board on each path, it bounds the datagrams sent with GSO
+            self.__path_mtu = []
+            board_ips = [config.board_ip_eth0, config.board_ip_eth1]
+            for namespace, board_ip in zip(namespaces, board_ips):
+                probe = netns_socket(namespace, socket.AF_INET, socket.SOCK_DGRAM)
+                self.__path_mtu.append(path_mtu(probe, (board_ip, config.board_tcpip_port)))
+                probe.close()
         # input message size
         self.__message_size = config.message_size
-        # random message
-        self.__message = ''.join(random.choice(string.ascii_lowercase) for i in range(
-            self.__message_size - self.header_size))
+        # random message of lowercase letters, built directly as bytes since that is all the
+        # senders need
+        self.__message_bytes = os.urandom(self.__message_size - self.header_size).translate(
+            self.LOWERCASE_TABLE)
 
         self.__timeout = config.timeout
+        # CPUs to which the threads are pinned, handed out in the order the threads are created.
+        # By default there is one CPU for each receiver and sender thread.
+        paths = 2 if config.duplex == "full" else 1
+        threads = paths * (self.__rx_threads + 1)
+        self.__cpus = config.cpu_mask or sorted(os.sched_getaffinity(0))[:threads]
+        if threads > len(set(self.__cpus)):
+            print(f"{threads} threads but only {len(set(self.__cpus))} CPUs to pin them to, "
+                  f"the senders share CPUs with the receivers")
 
         # Statistics
         self.__sent_packets_eth = [0, 0]
-        self.__received_packets_eth = [0, 0]
+        # One counter for each thread, written by the thread when it finishes. The receiver
+        # counters are summed when the test is over.
+        self.__received_packets_eth = [[0] * self.__rx_threads for _ in range(2)]
 
         # synchronization variables for threads
         self.__run_sender = False
         self.__run_receiver = False
 
-    def __send_packets(self, idx, send_address):
+    @staticmethod
+    def __tune_tcp_socket(sock, buf_size):
+        '''Disables Nagle's algorithm and sizes the socket buffers. Must be called before the
+           socket is connected so that the TCP window is negotiated with the final buffer sizes.
+           :param sock: the TCP socket
+           :param buf_size: size of the send and receive buffers in bytes, 0 keeps the kernel
+                            autotuning
+        '''
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if buf_size:
+            # Setting the buffer sizes explicitly disables the kernel autotuning for this socket
+            rcv_size, snd_size = set_buffer_sizes(sock, buf_size)
+            # The kernel reports twice the size it was given, unless it capped it
+            if min(rcv_size, snd_size) < 2 * buf_size:
+                print(f"Socket buffers capped by the kernel limits (net.core.rmem_max/wmem_max): "
+                      f"requested {buf_size} bytes, got receive {rcv_size // 2} bytes and "
+                      f"send {snd_size // 2} bytes")
+
+    def __send_packets(self, idx, send_address, cpu):
         '''Keep sending packets to the target until signaled by main thread to stop.
            :param idx: indicates the socket used
            :param send_address: a tuple that contains the ip and port number of target socket
+           :param cpu: the CPU on which the thread runs
         '''
-        while self.__run_sender:
-            try:
-                self.__sock_ns[idx].sendto(self.__message.encode(), send_address)
-                self.__sent_packets_eth[idx] += 1
-            except socket.timeout:
-                pass
-            #send 10 packets every 1ms otherwise we might overrun the OS buffers
-            time.sleep(1.0/10**4)
+        os.sched_setaffinity(0, {cpu})
+        message = self.__message_bytes
+        segments = 1
+        # There is no need to throttle the senders, they only queue as much as the socket send
+        # buffer can hold.
+        if self.__conn_type == "TCP":
+            # The socket is connected, the messages are written back to back in the stream and
+            # only the completely written ones are counted
+            sender = StreamSender(self.__sock_ns[idx], message, zerocopy=self.__zerocopy)
+        else:
+            # Let the kernel split one large buffer into message sized datagrams, each message
+            # sent by sendmmsg carries <segments> packets
+            segments = enable_udp_gso(self.__sock_ns[idx], len(message), self.__path_mtu[idx])
+            sender = MMsgSender(self.__sock_ns[idx], message * segments, send_address)
+        # Count in a local variable and publish the total once the thread is done, so the
+        # shared statistics are not touched while the test is running
+        sent_packets = 0
+        try:
+            while self.__run_sender:
+                try:
+                    sent_packets += sender.send_batch() * segments
+                except socket.timeout:
+                    pass
+                except OSError as err:
+                    if segments == 1 or err.errno not in UDP_GSO_SEND_ERRORS:
+                        raise
+                    # The path can not carry GSO sends, send one datagram per message instead
+                    print(f"UDP GSO send failed ({err}), disabling GSO on eth path {idx}")
+                    disable_udp_gso(self.__sock_ns[idx])
+                    segments = 1
+                    sender = MMsgSender(self.__sock_ns[idx], message, send_address)
+        finally:
+            self.__sent_packets_eth[idx] = sent_packets
 
-    def __receive_packets(self, idx):
+    def __receive_packets(self, idx, rx_idx, cpu):
         '''Keep trying to receive packets until signaled by main thread to stop.
-           :param idx: indicates the used socket
+           :param idx: indicates the ethernet path
+           :param rx_idx: indicates the receiving socket of the ethernet path
+           :param cpu: the CPU on which the thread runs
         '''
-        while self.__run_receiver:
-            try:
-                self.__sock_ns[idx].recvfrom(self.__message_size)
-                self.__received_packets_eth[idx] += 1
-            except socket.timeout:
-                pass
+        os.sched_setaffinity(0, {cpu})
+        sock = self.__rx_socks[idx][rx_idx]
+        # Count in a local variable and publish the total once the thread is done
+        recv_packets = 0
+        try:
+            while self.__run_receiver:
+                try:
+                    sock.recvfrom(self.__message_size)
+                    recv_packets += 1
+                except socket.timeout:
+                    pass
+        finally:
+            self.__received_packets_eth[idx][rx_idx] = recv_packets
 
     def print_test_results(self,idx):
         '''Computes the benchmark metrics and writes them to output log(s) file(s)
@@ -162,7 +281,7 @@ class M7ETHBenchmark():
         '''
         with open(cfg.logfile[idx], "w+", encoding='utf-8') as out_fd:
             sent_packets = self.__sent_packets_eth[idx]
-            recv_packets = self.__received_packets_eth[idx-1]
+            recv_packets = sum(self.__received_packets_eth[idx-1])
             lost_packets = float(sent_packets - recv_packets) / float(sent_packets) * float(100)
             bandwidth = float(recv_packets * self.__message_size * 8) /\
                         float(self.__timeout * self.BITS_IN_MBIT)
@@ -188,19 +307,28 @@ class M7ETHBenchmark():
         print("#######################################")
         self.__run_receiver = True
         self.__run_sender = True
-        receiver_thread_eth1 = threading.Thread(target=self.__receive_packets,args=(1,))
-        receiver_thread_eth1.start()
+        # Each thread is pinned to a CPU so that it does not migrate during the test, the CPUs
+        # are reused if there are more threads than CPUs (warned about in __init__)
+        cpus = itertools.cycle(self.__cpus)
+        receiver_threads = [threading.Thread(target=self.__receive_packets,
+                                             args=(1, rx_idx, next(cpus)))
+                            for rx_idx in range(self.__rx_threads)]
         if cfg.duplex == "full":
-            receiver_thread_eth0 = threading.Thread(target=self.__receive_packets,args=(0,))
-            receiver_thread_eth0.start()
+            receiver_threads += [threading.Thread(target=self.__receive_packets,
+                                                  args=(0, rx_idx, next(cpus)))
+                                 for rx_idx in range(self.__rx_threads)]
+        for receiver_thread in receiver_threads:
+            receiver_thread.start()
         time.sleep(1)
         sender_thread_eth0 = threading.Thread(target=self.__send_packets,
-                                              args=(0, (cfg.board_ip_eth0, cfg.board_tcpip_port)))
+                                              args=(0, (cfg.board_ip_eth0, cfg.board_tcpip_port),
+                                                    next(cpus)))
         sender_thread_eth0.start()
         if cfg.duplex == "full":
             sender_thread_eth1 = threading.Thread(target=self.__send_packets,
                                                   args=(1,
-                                                  (cfg.board_ip_eth1, cfg.board_tcpip_port)))
+                                                  (cfg.board_ip_eth1, cfg.board_tcpip_port),
+                                                  next(cpus)))
             sender_thread_eth1.start()
 
         # Wait while the test is running
@@ -212,14 +340,15 @@ class M7ETHBenchmark():
         time.sleep(1)
         self.__run_receiver = False
 
-        receiver_thread_eth1.join()
+        for receiver_thread in receiver_threads:
+            receiver_thread.join()
         if cfg.duplex == "full":
-            receiver_thread_eth0.join()
             sender_thread_eth1.join()
         sender_thread_eth0.join()
 
-        self.__sock_ns[0].close()
-        self.__sock_ns[1].close()
+        for rx_socks in self.__rx_socks:
+            for sock in rx_socks:
+                sock.close()
         self.print_test_results(0)
         if cfg.duplex == "full":
             self.print_test_results(1)
@@ -250,6 +379,24 @@ if __name__ == '__main__':
     parser.add_argument("-ns0", dest="ns0", type=str, default="nw_ns0", help="Network namespace 0")
     parser.add_argument("-ns1", dest="ns1", type=str, default="nw_ns1", help="Network namespace 1")
     parser.add_argument("-log", dest="logfile", nargs=2, help="List of files for output log")
+    parser.add_argument("-sock-buf", dest="sock_buf", type=int, default=4 * 1024 * 1024,
+                        help="TCP send/receive buffer size in bytes. Setting it disables the "
+                             "kernel buffer autotuning, use 0 to keep autotuning. The size is "
+                             "subject to the kernel limits: as root it may exceed "
+                             "net.core.rmem_max/wmem_max, otherwise it is capped to them")
+    parser.add_argument("-zerocopy", dest="zerocopy", action="store_true",
+                        help="Send TCP data with MSG_ZEROCOPY. Only pays off for large "
+                             "message sizes")
+    parser.add_argument("-rx-threads", dest="rx_threads", type=positive_int, default=1,
+                        help="Number of receiving sockets/threads per UDP path, bound to the same "
+                             "address with SO_REUSEPORT. The kernel assigns each flow to a single "
+                             "socket and the board sends one flow per path, so more threads only "
+                             "help if the traffic is made of several flows")
+    parser.add_argument("-cpu-mask", dest="cpu_mask", type=cpu_list, default=None,
+                        help="Comma separated CPUs to pin the receiver and then the sender threads "
+                             "to, one CPU per thread keeps senders and receivers apart. For best "
+                             "results use CPUs on the NUMA node of the NIC RX queues (see "
+                             "/proc/interrupts) (default: one available CPU per thread)")
     parser.add_argument("-d", dest="duplex", type=str, default="half",
                         help="Duplex option (half/full)")
 
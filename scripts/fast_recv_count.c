@@ -0,0 +1,91 @@
+// SPDX-License-Identifier: BSD-3-Clause
+/*
+ * Copyright 2022 NXP
+ *
+ * Counts the datagrams received on a socket without going through the python
+ * interpreter for each of them. It is loaded through ctypes by libc_socket.py
+ * when built next to it:
+ *
+ *     gcc -O2 -shared -fPIC -o fast_recv_count.so fast_recv_count.c
+ */
+
+#define _GNU_SOURCE
+#include <errno.h>
+#include <poll.h>
+#include <stdint.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/socket.h>
+
+#define BATCH_SIZE 64
+
+/*
+ * Receive and count datagrams until none arrives for a whole timeout.
+ * fd:       the socket to read from
+ * msgsize:  the maximum size of a datagram
+ * seconds:  how long to wait for a datagram before returning
+ * Returns the number of received datagrams, or -1 with errno set if receiving failed.
+ */
+int64_t count_until_timeout(int fd, size_t msgsize, double seconds)
+{
+	struct mmsghdr msgs[BATCH_SIZE];
+	struct iovec iov;
+	struct pollfd pfd = { .fd = fd, .events = POLLIN };
+	int timeout_ms = (int)(seconds * 1000);
+	int use_recvmmsg = 1;
+	int64_t count = 0;
+	char *buf;
+	int i, ret, err;
+
+	/* The content is discarded, all the datagrams of a batch share one buffer */
+	buf = malloc(msgsize);
+	if (!buf)
+		return -1;
+
+	iov.iov_base = buf;
+	iov.iov_len = msgsize;
+	memset(msgs, 0, sizeof(msgs));
+	for (i = 0; i < BATCH_SIZE; i++) {
+		msgs[i].msg_hdr.msg_iov = &iov;
+		msgs[i].msg_hdr.msg_iovlen = 1;
+	}
+
+	for (;;) {
+		ret = poll(&pfd, 1, timeout_ms);
+		if (ret < 0) {
+			if (errno == EINTR)
+				continue;
+			count = -1;
+			break;
+		}
+		/* Timeout: the sender does not send packets anymore */
+		if (ret == 0)
+			break;
+
+		if (use_recvmmsg) {
+			ret = recvmmsg(fd, msgs, BATCH_SIZE, MSG_DONTWAIT, NULL);
+			if (ret < 0 && errno == ENOSYS) {
+				use_recvmmsg = 0;
+				continue;
+			}
+		} else {
+			ret = recv(fd, buf, msgsize, MSG_DONTWAIT);
+			if (ret >= 0)
+				ret = 1;
+		}
+
+		if (ret < 0) {
+			if (errno == EAGAIN || errno == EWOULDBLOCK || errno == EINTR)
+				continue;
+			count = -1;
+			break;
+		}
+		count += ret;
+	}
+
+	/* Keep the errno of the failure for the caller */
+	err = errno;
+	free(buf);
+	errno = err;
+	return count;
+}
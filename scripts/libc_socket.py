@@ -0,0 +1,371 @@
+#!/usr/bin/env python3.8
+# SPDX-License-Identifier: BSD-3-Clause
+# -*- coding: utf-8 -*-
+
+"""
+Copyright 2022 NXP
+"""
+
+import ctypes
+import errno
+import os
+import select
+import socket
+
+libc = ctypes.CDLL('libc.so.6', use_errno=True)
+
+# Flag for recvmmsg: block until the first message arrives, then return what is queued
+MSG_WAITFORONE = 0x10000
+# Socket option level and option for UDP generic segmentation offload (linux/udp.h)
+SOL_UDP = 17
+UDP_SEGMENT = 103
+# The kernel limits the number of segments of a single UDP GSO send
+UDP_MAX_SEGMENTS = 64
+# Maximum payload of a single UDP datagram over IPv4
+UDP_MAX_PAYLOAD = 65507
+# Size of the IPv4 and UDP headers in front of each datagram payload
+UDP_IP_HEADER_SIZE = 28
+# Errors returned by a GSO send which the path (e.g. a NIC without checksum offload) can not carry
+UDP_GSO_SEND_ERRORS = (errno.EMSGSIZE, errno.EINVAL, errno.EIO)
+# Socket option returning the path MTU of a connected socket (linux/in.h)
+IP_MTU = 14
+# Socket options setting the buffer sizes above net.core.wmem_max/rmem_max, they need
+# CAP_NET_ADMIN (asm-generic/socket.h)
+SO_SNDBUFFORCE = 32
+SO_RCVBUFFORCE = 33
+# Socket option and send flag for zero copy transmission (linux/socket.h)
+SO_ZEROCOPY = 60
+MSG_ZEROCOPY = 0x4000000
+# Flags used to read the zero copy completions from the socket error queue
+MSG_DONTWAIT = 0x40
+MSG_ERRQUEUE = 0x2000
+
+class IoVec(ctypes.Structure):
+    '''Mirror of the C struct iovec.
+    '''
+    _fields_ = [('iov_base', ctypes.c_void_p),
+                ('iov_len', ctypes.c_size_t)]
+
+class MsgHdr(ctypes.Structure):
+    '''Mirror of the C struct msghdr.
+    '''
+    _fields_ = [('msg_name', ctypes.c_void_p),
+                ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(IoVec)),
+                ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p),
+                ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+class SockAddrIn(ctypes.Structure):
+    '''Mirror of the C struct sockaddr_in.
+    '''
+    _fields_ = [('sin_family', ctypes.c_ushort),
+                ('sin_port', ctypes.c_uint16),
+                ('sin_addr', ctypes.c_uint8 * 4),
+                ('sin_zero', ctypes.c_uint8 * 8)]
+
+    @classmethod
+    def from_address_tuple(cls, address):
+        '''Builds a sockaddr_in from a python (ip, port) address tuple.
+           :param address: a tuple that contains the ip and port number
+           :return: the equivalent sockaddr_in
+        '''
+        addr = cls()
+        addr.sin_family = socket.AF_INET
+        addr.sin_port = socket.htons(address[1])
+        ctypes.memmove(addr.sin_addr, socket.inet_aton(address[0]), 4)
+        return addr
+
+class MMsgHdr(ctypes.Structure):
+    '''Mirror of the C struct mmsghdr used by recvmmsg/sendmmsg.
+    '''
+    _fields_ = [('msg_hdr', MsgHdr),
+                ('msg_len', ctypes.c_uint)]
+
+libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(MMsgHdr), ctypes.c_uint, ctypes.c_int,
+                          ctypes.c_void_p]
+libc.recvmmsg.restype = ctypes.c_int
+libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(MMsgHdr), ctypes.c_uint, ctypes.c_int]
+libc.sendmmsg.restype = ctypes.c_int
+libc.recvmsg.argtypes = [ctypes.c_int, ctypes.POINTER(MsgHdr), ctypes.c_int]
+libc.recvmsg.restype = ctypes.c_ssize_t
+
+def load_fast_recv_count():
+    '''Loads the optional C receive loop from fast_recv_count.so, built from fast_recv_count.c
+       next to this file.
+       :return: the library, or None if it was not built
+    '''
+    path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'fast_recv_count.so')
+    try:
+        lib = ctypes.CDLL(path, use_errno=True)
+    except OSError:
+        return None
+    lib.count_until_timeout.argtypes = [ctypes.c_int, ctypes.c_size_t, ctypes.c_double]
+    lib.count_until_timeout.restype = ctypes.c_int64
+    return lib
+
+def set_buffer_sizes(sock, size):
+    '''Sets the send and receive buffer sizes of a socket. When the process is allowed to, the
+       net.core.wmem_max/rmem_max limits are bypassed, otherwise the kernel silently caps the
+       sizes to them.
+       :param sock: the socket
+       :param size: the requested size in bytes
+       :return: tuple(receive buffer size, send buffer size) as reported by the kernel, which
+                doubles the requested size to account for its bookkeeping overhead
+    '''
+    for option, force_option in ((socket.SO_RCVBUF, SO_RCVBUFFORCE),
+                                 (socket.SO_SNDBUF, SO_SNDBUFFORCE)):
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, force_option, size)
+        except PermissionError:
+            sock.setsockopt(socket.SOL_SOCKET, option, size)
+    return (sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF),
+            sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF))
+
+def enable_zerocopy(sock):
+    '''Allows the socket to transmit data straight from the user buffers, without copying it
+       into the kernel. The buffers must not change until the kernel reports the send completion.
+       :param sock: the socket
+       :return: True if zero copy transmission is available
+    '''
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_ZEROCOPY, 1)
+    except OSError:
+        # Kernels older than 4.14 do not support SO_ZEROCOPY
+        return False
+    return True
+
+def path_mtu(sock, address):
+    '''Reads the MTU of the route towards an address.
+       :param sock: an unused UDP socket, it is connected to the address
+       :param address: a tuple that contains the ip and port number of the destination
+       :return: the path MTU, None if there is no route to the address
+    '''
+    try:
+        sock.connect(address)
+        return sock.getsockopt(socket.IPPROTO_IP, IP_MTU)
+    except OSError:
+        return None
+
+def enable_udp_gso(sock, segment_size, mtu):
+    '''Enables UDP generic segmentation offload on a socket, so that one send of a large buffer
+       is split by the kernel (or the NIC) into datagrams of segment_size bytes.
+       :param sock: the UDP socket
+       :param segment_size: the size of each datagram put on the wire
+       :param mtu: the MTU of the path, None if unknown
+       :return: the number of segments that fit in one send, 1 if GSO is not available
+    '''
+    # GSO does not fragment, each segment must fit in a single IP packet
+    if mtu is None or segment_size + UDP_IP_HEADER_SIZE > mtu:
+        return 1
+    segments = min(UDP_MAX_SEGMENTS, UDP_MAX_PAYLOAD // segment_size)
+    if segments <= 1:
+        return 1
+    try:
+        sock.setsockopt(SOL_UDP, UDP_SEGMENT, segment_size)
+    except OSError:
+        # Kernels older than 4.18 do not support UDP_SEGMENT
+        return 1
+    return segments
+
+def disable_udp_gso(sock):
+    '''Disables UDP generic segmentation offload on a socket, each send is one datagram again.
+       :param sock: the UDP socket
+    '''
+    sock.setsockopt(SOL_UDP, UDP_SEGMENT, 0)
+
+class MMsgReceiver():
+    '''Receives datagrams from a socket in batches using a single recvmmsg call per batch.
+       Falls back to one recvfrom per datagram if the kernel does not implement recvmmsg.
+    '''
+    BATCH_SIZE = 64
+
+    def __init__(self, sock, message_size, batch_size=BATCH_SIZE):
+        '''
+           :param sock: the socket from which the datagrams are received
+           :param message_size: the maximum size of a datagram
+           :param batch_size: the maximum number of datagrams received by a single call
+        '''
+        self.__sock = sock
+        self.__message_size = message_size
+        self.__batch_size = batch_size
+        self.__use_recvmmsg = True
+
+        # Preallocate the buffers and the headers which point at them, they are reused by
+        # every call
+        self.__buffers = [ctypes.create_string_buffer(message_size) for _ in range(batch_size)]
+        self.__iovecs = (IoVec * batch_size)()
+        self.__msgs = (MMsgHdr * batch_size)()
+        for i in range(batch_size):
+            self.__iovecs[i].iov_base = ctypes.cast(self.__buffers[i], ctypes.c_void_p)
+            self.__iovecs[i].iov_len = message_size
+            self.__msgs[i].msg_hdr.msg_iov = ctypes.pointer(self.__iovecs[i])
+            self.__msgs[i].msg_hdr.msg_iovlen = 1
+
+        self.__poller = select.poll()
+        self.__poller.register(sock, select.POLLIN)
+
+    @property
+    def batched(self):
+        '''True while the datagrams are received with recvmmsg, False after falling back to
+           recvfrom.
+        '''
+        return self.__use_recvmmsg
+
+    def recv_batch(self):
+        '''Waits for the socket to become readable and receives all queued datagrams (up to the
+           batch size).
+           :return: the number of datagrams received
+           :raises socket.timeout: if nothing was received within the socket timeout
+        '''
+        if not self.__use_recvmmsg:
+            self.__sock.recvfrom(self.__message_size)
+            return 1
+
+        # The socket is non-blocking when it has a timeout, so wait for data the same way
+        # socket.recvfrom does
+        timeout = self.__sock.gettimeout()
+        if timeout is not None and not self.__poller.poll(timeout * 1000):
+            raise socket.timeout('timed out')
+
+        received = libc.recvmmsg(self.__sock.fileno(), self.__msgs, self.__batch_size,
+                                 MSG_WAITFORONE, None)
+        if received < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSYS:
+                self.__use_recvmmsg = False
+                return self.recv_batch()
+            if err in (errno.EAGAIN, errno.EINTR):
+                return 0
+            raise OSError(err, os.strerror(err))
+        return received
+
+class MMsgSender():
+    '''Sends the same datagram repeatedly, a batch of datagrams per sendmmsg call.
+       Falls back to one sendto per datagram if the kernel does not implement sendmmsg.
+       Stream sockets must use StreamSender, which handles short writes.
+    '''
+    BATCH_SIZE = 32
+
+    def __init__(self, sock, payload, address, batch_size=BATCH_SIZE):
+        '''
+           :param sock: the datagram socket through which the messages are sent
+           :param payload: the bytes sent by each message
+           :param address: a tuple that contains the ip and port number of the destination
+           :param batch_size: the maximum number of messages sent by a single call
+        '''
+        self.__sock = sock
+        self.__payload = payload
+        self.__address = address
+        self.__batch_size = batch_size
+        self.__use_sendmmsg = True
+
+        # All the messages point at the same buffer and destination
+        self.__buffer = ctypes.create_string_buffer(payload, len(payload))
+        self.__iovec = IoVec(ctypes.cast(self.__buffer, ctypes.c_void_p), len(payload))
+        self.__sockaddr = SockAddrIn.from_address_tuple(address)
+        self.__msgs = (MMsgHdr * batch_size)()
+        for i in range(batch_size):
+            self.__msgs[i].msg_hdr.msg_iov = ctypes.pointer(self.__iovec)
+            self.__msgs[i].msg_hdr.msg_iovlen = 1
+            self.__msgs[i].msg_hdr.msg_name = ctypes.cast(ctypes.pointer(self.__sockaddr),
+                                                          ctypes.c_void_p)
+            self.__msgs[i].msg_hdr.msg_namelen = ctypes.sizeof(self.__sockaddr)
+
+        self.__poller = select.poll()
+        self.__poller.register(sock, select.POLLOUT)
+
+    def send_batch(self):
+        '''Waits for the socket to become writable and sends a batch of messages.
+           :return: the number of messages sent
+           :raises socket.timeout: if the socket did not become writable within its timeout
+        '''
+        if not self.__use_sendmmsg:
+            # A datagram is either sent whole or not at all
+            self.__sock.sendto(self.__payload, self.__address)
+            return 1
+
+        # The socket is non-blocking when it has a timeout, so wait for room in the send
+        # queue the same way socket.sendto does
+        timeout = self.__sock.gettimeout()
+        if timeout is not None and not self.__poller.poll(timeout * 1000):
+            raise socket.timeout('timed out')
+
+        sent = libc.sendmmsg(self.__sock.fileno(), self.__msgs, self.__batch_size, 0)
+        if sent < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSYS:
+                self.__use_sendmmsg = False
+                return self.send_batch()
+            if err in (errno.EAGAIN, errno.EINTR, errno.ENOBUFS):
+                return 0
+            raise OSError(err, os.strerror(err))
+        return sent
+
+class StreamSender():
+    '''Sends the same payload repeatedly over a connected stream socket, a batch of messages
+       per send call. A stream has no message boundaries, so a short write is resumed from the
+       byte where it stopped and only the messages written completely are counted.
+    '''
+    BATCH_SIZE = 32
+
+    # Size of the control buffer used to read one zero copy completion
+    ZEROCOPY_CONTROL_SIZE = 128
+
+    def __init__(self, sock, payload, batch_size=BATCH_SIZE, zerocopy=False):
+        '''
+           :param sock: the connected socket through which the messages are sent
+           :param payload: the bytes sent by each message
+           :param batch_size: the number of messages handed to the socket by one send call
+           :param zerocopy: send with MSG_ZEROCOPY, the socket must have SO_ZEROCOPY enabled
+        '''
+        self.__sock = sock
+        self.__message_size = len(payload)
+        # A batch of messages laid back to back, sent from the current offset. The buffer is
+        # never modified, so it can be handed to the kernel without being copied.
+        self.__batch = memoryview(payload * batch_size)
+        self.__offset = 0
+        self.__flags = MSG_ZEROCOPY if zerocopy else 0
+
+        # The zero copy completions are only read to keep the error queue from filling up,
+        # their content is discarded
+        self.__completion_control = ctypes.create_string_buffer(self.ZEROCOPY_CONTROL_SIZE)
+        self.__completion_msg = MsgHdr()
+        self.__completion_msg.msg_control = ctypes.cast(self.__completion_control,
+                                                        ctypes.c_void_p)
+
+    def send_batch(self):
+        '''Sends the rest of the current batch, resuming after short writes.
+           :return: the number of messages completely written to the socket
+           :raises socket.timeout: if the socket did not become writable within its timeout and
+                                   no message was completed
+        '''
+        if self.__flags & MSG_ZEROCOPY:
+            self.__drain_completions()
+
+        messages = 0
+        while True:
+            try:
+                sent = self.__sock.send(self.__batch[self.__offset:], self.__flags)
+            except socket.timeout:
+                if messages:
+                    return messages
+                raise
+            # Count the message boundaries crossed by this write
+            messages += ((self.__offset + sent) // self.__message_size -
+                         self.__offset // self.__message_size)
+            self.__offset += sent
+            if self.__offset == len(self.__batch):
+                self.__offset = 0
+                return messages
+
+    def __drain_completions(self):
+        '''Reads all the pending zero copy completions from the socket error queue, without
+           blocking.
+        '''
+        while True:
+            self.__completion_msg.msg_controllen = self.ZEROCOPY_CONTROL_SIZE
+            if libc.recvmsg(self.__sock.fileno(), ctypes.byref(self.__completion_msg),
+                            MSG_ERRQUEUE | MSG_DONTWAIT) < 0:
+                return
@@ -25,25 +25,27 @@ DEFAULT_SCALER_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)),
 WINDOW_SIZE = 70
 
 
-def windowed_dataset(df, window_size):
+def windowed_dataset(features, labels, window_size):
     """
     Convert one dataset in matrices of dimension (window_size, nb_features) as input for the Neural Network.
-    :param df: the dataset as a numpy array
+    :param features: the dataset features as a numpy array of shape (nb_rows, nb_features)
+    :param labels: the dataset labels as a numpy array of shape (nb_rows,)
     :param window_size: window size
     :return: tuple(numpy array containing input sequences, numpy array with the labels)
     """
-    sequences, labels = list(), list()
+    # Each window needs the row following it in the dataset, so fewer rows give no sequences.
+    if features.shape[0] <= window_size:
+        return (np.empty((0, window_size, features.shape[1]), dtype=features.dtype),
+                np.empty((0,), dtype=labels.dtype))
 
-    for i in range(df.shape[0]):
-        end_ix = i + window_size
-        if end_ix > df.shape[0] - 1:
-            break
+    # Zero-copy view of all the windows, shaped as (nb_windows, window_size, nb_features).
+    # The last window is dropped since no row follows it.
+    sequences = np.lib.stride_tricks.sliding_window_view(
+        features, window_shape=window_size, axis=0).transpose(0, 2, 1)[:-1]
+    # The label of a window is the one of its last row.
+    labels = labels[window_size - 1:-1]
 
-        window_seq, window_label = df[i:end_ix, :-1], df[end_ix-1, -1]
-        sequences.append(window_seq)
-        labels.append(window_label)
-
-    return np.array(sequences), np.array(labels)
+    return sequences, labels
 
 
 def add_mean_variance(seq_array, feature_col_idx, window_size):
@@ -55,16 +57,19 @@ def add_mean_variance(seq_array, feature_col_idx, window_size):
 
     :return: numpy array containing the altered input sequences
     """
-    new_seq_array = np.zeros((seq_array.shape[0], seq_array.shape[1], seq_array.shape[2] + 2))
+    nb_features = seq_array.shape[2]
+    # Every element is written below, so the array does not need to be zeroed first.
+    new_seq_array = np.empty((seq_array.shape[0], window_size, nb_features + 2), dtype=seq_array.dtype)
 
-    for idx, sample in enumerate(seq_array):
-        f_mean = np.array([sample[:, feature_col_idx].mean()] * window_size)
-        f_var = np.array([sample[:, feature_col_idx].var()] * window_size)
-        f_mean = f_mean.reshape(-1, 1)
-        f_var = f_var.reshape(-1, 1)
+    # Statistics of each sample, shaped as (nb_samples, 1)
+    feature = seq_array[:, :, feature_col_idx]
+    f_mean = feature.mean(axis=1, keepdims=True)
+    f_var = feature.var(axis=1, keepdims=True)
 
-        stat = np.concatenate((f_mean, f_var), axis=1)
-        new_seq_array[idx] = np.concatenate((sample, stat), axis=1)
+    # Copy the sequences and repeat the statistics over the whole window as two new features
+    new_seq_array[:, :, :nb_features] = seq_array
+    new_seq_array[:, :, nb_features] = f_mean
+    new_seq_array[:, :, nb_features + 1] = f_var
 
     return new_seq_array
 
@@ -77,6 +82,7 @@ def bms_get_data(data_path, scaler_path):
 
     :param data_path: Path to the csv file containing the BMS data.
     :param scaler_path: Path to the scaler model to be used for normalizing the dataset.
+    :return: tuple(numpy array containing input sequences, numpy array with the labels)
     """
     test_df = pd.read_csv(data_path)
 
@@ -87,23 +93,28 @@ def bms_get_data(data_path, scaler_path):
 
     # Preprocessing the dataset - rename some columns in order to have more representative names.
     # This might be not needed if another dataset is used.
-    for i in range(1, 7):
-        test_df.rename(columns={"{}".format(-i): 'Temp_cell_{}'.format(i)}, inplace=True)
-        test_df.rename(columns={"{}".format(-i * 100): 'Cell_voltage_{}'.format(i)}, inplace=True)
+    # All the columns are renamed by a single call.
+    new_names = {**{"{}".format(-i): 'Temp_cell_{}'.format(i) for i in range(1, 7)},
+                 **{"{}".format(-i * 100): 'Cell_voltage_{}'.format(i) for i in range(1, 7)}}
+    test_df.rename(columns=new_names, inplace=True)
 
     # Keep 3 features from the dataset, along with the label.
     columns = ['Pack_Current', 'Cell_voltage_1', 'Temp_cell_1', 'TrueSOC1']
 
     test_df = test_df[columns][test_df["Time"] % 1 == 0]
 
-    # Normalization.
-    test_df.iloc[:, :-1] = scaler.transform(test_df.iloc[:, :-1])
-    test_df = np.array(test_df)
+    # Convert once to numpy arrays. The features are processed as float32, while the labels
+    # keep their full precision since they are sent to the board as they are.
+    features = test_df[columns[:-1]].to_numpy(dtype=np.float32)
+    labels = test_df[columns[-1]].to_numpy()
+
+    # Normalization of the features, written back in place.
+    features[:] = scaler.transform(features)
 
-    seq_array, label_array = windowed_dataset(test_df, WINDOW_SIZE)
+    seq_array, label_array = windowed_dataset(features, labels, WINDOW_SIZE)
     seq_array = add_mean_variance(seq_array, 1, WINDOW_SIZE)
 
-    return ((seq, soc) for seq, soc in zip(seq_array, label_array))
+    return seq_array, label_array
 
 
 def main():
@@ -123,13 +134,19 @@ def main():
                         help="Time step between data sends.")
     parser.add_argument("--stop-after", type=int, default=None,
                         help="Only send a set number of data inputs.")
+    parser.add_argument("--binary", action="store_true",
+                        help="Send the input data as raw float32 values instead of text. "
+                             "The app on the board must expect this format.")
     args = parser.parse_args()
 
+    data, labels = bms_get_data(args.data_file, args.scaler_file)
     DataProviderClient(
-        data_sequence=bms_get_data(args.data_file, args.scaler_file),
+        data=data,
+        labels=labels,
         time_step=args.time_step,
         port=args.board_port,
-        board_ip=args.board_ip).send_all(args.stop_after)
+        board_ip=args.board_ip,
+        binary=args.binary).send_all(args.stop_after)
 
 
 if __name__ == '__main__':
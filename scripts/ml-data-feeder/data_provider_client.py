@@ -7,6 +7,7 @@ Copyright 2022 NXP
 """
 
 import logging
+import select
 import socket
 import struct
 import sys
@@ -26,78 +27,149 @@ class DataProviderClient():
     machine learning model running on the board.
     """
 
-    def __init__(self, data_sequence, board_ip, port, time_step=1):
+    # Number of times a pair is sent before giving up when the connection is lost.
+    SEND_ATTEMPTS = 2
+    # Time to wait before reconnecting to the board.
+    RECONNECT_DELAY = 1
+
+    def __init__(self, data, labels, board_ip, port, time_step=1, binary=False):
         """
-        :param data_sequence: Iterable sequence of (input_data, label) pairs.
+        :param data: Array of input data, indexed by sample on its first axis.
+        :param labels: Array with the label of each input data.
         :param board_ip: Ip of the board where the receiver server resides.
         :param port: Port used for the eth connection.
         :param time_step: Time between subsequent sends.
+        :param binary: Send the input data as raw little-endian float32 values instead of text.
         """
-        self.data_sequence = data_sequence
+        self.data = data
+        self.labels = labels
         self.__board_ip = board_ip
         self.__port = port
         self.__time_step = time_step
+        self.__binary = binary
 
         self.__socket = None
 
-    def send_data(self, data, label=None, socket_timeout=1):
+    @staticmethod
+    def __text_payload(data):
         """
-        Send a pair of input data and label to the receiver server.
+        Serialize the input data as space separated decimal numbers.
         :param data: The input data for the model.
-        :param label: The real label for the input data.
+        :return: The encoded payload.
+        """
+        # After a certain threshold the numpy array converts into a string
+        # with gaps (0, 1 ... 10, 11). We need to set this threshold high enough
+        # so we will get the whole data array as a string without this gap.
+        # For each number we expect to have at most <FLOAT_PRECISION + 4> characters.
+        # (The four comes from: one char for the dot, one for the single integer digit,
+        # one for the space between numbers, and one for misc extra chars such as endl)
+        threshold = data.size * (FLOAT_PRECISION + 4)
+
+        # Convert the numpy array to string and get rid of the consecutive whitespaces.
+        return ' '.join(np.array2string(
+            data.flatten(), precision=FLOAT_PRECISION,
+            floatmode='fixed', suppress_small=True, threshold=threshold)[1:-1].split()).encode()
+
+    @staticmethod
+    def __binary_payload(data):
+        """
+        Serialize the input data as raw little-endian float32 values, in row-major order.
+        The receiver on the board must be built to parse this format instead of the text one.
+        :param data: The input data for the model.
+        :return: The encoded payload.
+        """
+        return np.ascontiguousarray(data, dtype='<f4').tobytes()
+
+    def __connect(self, socket_timeout):
+        """
+        Open the connection to the receiver server.
         :param socket_timeout: Timeout for socket operations.
         """
         self.__socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.__socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         if socket_timeout:
             self.__socket.settimeout(socket_timeout)
+        self.__socket.connect((self.__board_ip, self.__port))
 
+    def __peer_closed(self):
+        """
+        Check, without blocking, whether the receiver server closed the connection.
+        A single write into a connection closed by the peer does not fail, hence the
+        check is done before each send.
+        :return: True if the connection can not be used anymore.
+        """
+        readable, _, _ = select.select([self.__socket], [], [], 0)
+        if not readable:
+            return False
         try:
-            # After a certain threshold the numpy array converts into a string
-            # with gaps (0, 1 ... 10, 11). We need to set this threshold high enough
-            # so we will get the whole data array as a string without this gap.
-            # For each number we expect to have at most <FLOAT_PRECISION + 4> characters.
-            # (The four comes from: one char for the dot, one for the single integer digit,
-            # one for the space between numbers, and one for misc extra chars such as endl)
-            threshold = data.size * (FLOAT_PRECISION + 4)
-
-            # Convert the numpy array to string and get rid of the consecutive whitespaces.
-            payload = ' '.join(np.array2string(
-                data.flatten(), precision=FLOAT_PRECISION,
-                floatmode='fixed', suppress_small=True, threshold=threshold)[1:-1].split()).encode()
-
-            payload_size = struct.pack("i", len(payload))
-
-            # Connection might not be stable, hence we connect every time for higher reliability
-            self.__socket.connect((self.__board_ip, self.__port))
-            # Send the input data
-            self.__socket.sendall(payload_size)
-            self.__socket.sendall(payload)
-
-            # Send the label
-            if label:
-                payload = str(label).encode()
-                payload_size = struct.pack("i", len(payload))
-
-                self.__socket.sendall(payload_size)
-                self.__socket.sendall(payload)
-        # pylint: disable=broad-except
-        except Exception as exception:
-            LOGGER.error("Failed to send message to %s:%s\n%s",
-                         self.__board_ip, self.__port, exception)
-        finally:
+            return not self.__socket.recv(1, socket.MSG_PEEK)
+        except OSError:
+            return True
+
+    def close(self):
+        """
+        Close the connection to the receiver server, if any.
+        """
+        if self.__socket:
             self.__socket.close()
+            self.__socket = None
+
+    def send_data(self, data, label=None, socket_timeout=1):
+        """
+        Send a pair of input data and label to the receiver server.
+        The connection is opened on the first send and reused by the following ones.
+        :param data: The input data for the model.
+        :param label: The real label for the input data.
+        :param socket_timeout: Timeout for socket operations.
+        """
+        payload = self.__binary_payload(data) if self.__binary else self.__text_payload(data)
+
+        # Frame the input data and the label, each prefixed by its size, so that the whole
+        # pair is handed to the socket by a single call
+        message = struct.pack("i", len(payload)) + payload
+        if label:
+            payload = str(label).encode()
+            message += struct.pack("i", len(payload)) + payload
+
+        for _ in range(self.SEND_ATTEMPTS):
+            try:
+                if self.__socket and self.__peer_closed():
+                    self.close()
+                if not self.__socket:
+                    self.__connect(socket_timeout)
+
+                self.__socket.sendall(message)
+                return
+            except (BrokenPipeError, ConnectionResetError) as exception:
+                # Connection might not be stable, reconnect and send the pair again
+                LOGGER.warning("Lost connection to %s:%s, reconnecting\n%s",
+                               self.__board_ip, self.__port, exception)
+                self.close()
+                sleep(self.RECONNECT_DELAY)
+            # pylint: disable=broad-except
+            except Exception as exception:
+                LOGGER.error("Failed to send message to %s:%s\n%s",
+                             self.__board_ip, self.__port, exception)
+                self.close()
+                return
+
+        LOGGER.error("Failed to send message to %s:%s after %s attempts",
+                     self.__board_ip, self.__port, self.SEND_ATTEMPTS)
 
     def send_all(self, count=None):
         """
-        Send all (or a set number of) data-label pairs,
+        Send all (or a set number of) data-label pairs over a single connection,
         with the given time step interval between sends.
         :param count: The number of inputs to send. Must be int or None.
         """
-        for data, label in self.data_sequence:
-            self.send_data(data, label)
-            sleep(self.__time_step)
+        num_samples = len(self.labels)
+        if count and isinstance(count, int):
+            num_samples = min(count, num_samples)
 
-            if count and isinstance(count, int):
-                count -= 1
-                if count <= 0:
-                    break
+        try:
+            for i in range(num_samples):
+                # Indexing the first axis gives a view of the sample, no data is copied
+                self.send_data(self.data[i], self.labels[i])
+                sleep(self.__time_step)
+        finally:
+            self.close()
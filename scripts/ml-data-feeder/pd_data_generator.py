@@ -31,6 +31,7 @@ def pd_get_data(data_path):
     Besides each input data we provide the real RUL after that sequence of engine cycles.
 
     :param data_path: Path to the csv folder containing the predictive maintenance data.
+    :return: tuple(numpy array containing input sequences, numpy array with the labels)
     """
     sequences = []
     labels = []
@@ -41,20 +42,17 @@ def pd_get_data(data_path):
     sequence_cols = ['setting1', 'setting2', 'setting3', 'cycle_norm']
     sequence_cols.extend(sensor_cols)
 
-    for engine_id in test_df['id'].unique():
-        # We get the cycles of a single engine
-        engine_cycles = test_df[test_df['id']==engine_id]
+    # We get the cycles of each engine, in a single pass over the dataset
+    for _, engine_cycles in test_df.groupby('id', sort=False):
         # Some engines have fewer than SEQUENCE_LENGTH cycles and therefore we can't use
         # them as inputs.
         if engine_cycles.shape[0] <= SEQUENCE_LENGTH:
             continue
 
         # We get a matrix with only the input values,
-        data_matrix = engine_cycles[sequence_cols].values
+        data_matrix = engine_cycles[sequence_cols].to_numpy()
         # and an array with only the RUL values.
-        engine_cycles_rul = engine_cycles['RUL'].values
-
-        num_elements = data_matrix.shape[0]
+        engine_cycles_rul = engine_cycles['RUL'].to_numpy()
 
         # We generate the inputs for this engine.
         # If there are 60 cycles for an engine we will have 10 inputs:
@@ -62,15 +60,20 @@ def pd_get_data(data_path):
         # Input 2 with cycles 2 3 ... 51
         # ...
         # Input 10 with cycles 11 12 ... 60
-        for start, stop in zip(range(0, num_elements-SEQUENCE_LENGTH),
-                               range(SEQUENCE_LENGTH, num_elements)):
-            sequences.append(data_matrix[start:stop, :])
-            labels.append(engine_cycles_rul[stop])
+        # The window ending with the last cycle has no RUL after it, hence it is dropped.
+        windows = np.lib.stride_tricks.sliding_window_view(
+            data_matrix, window_shape=SEQUENCE_LENGTH, axis=0).transpose(0, 2, 1)
+        sequences.append(windows[:-1])
+        labels.append(engine_cycles_rul[SEQUENCE_LENGTH:])
+
+    if not sequences:
+        return np.empty((0, SEQUENCE_LENGTH, len(sequence_cols))), np.empty((0,))
 
-    seq_array = np.array(sequences)
-    label_array = np.array(labels)
+    # A single copy of all the windows into one array
+    seq_array = np.concatenate(sequences, axis=0)
+    label_array = np.concatenate(labels, axis=0)
 
-    return ((seq, rul) for seq, rul in zip(seq_array, label_array))
+    return seq_array, label_array
 
 
 def main():
@@ -88,13 +91,19 @@ def main():
                         help="Time step between data sends.")
     parser.add_argument("--stop-after", type=int, default=None,
                         help="Only send a set number of data inputs.")
+    parser.add_argument("--binary", action="store_true",
+                        help="Send the input data as raw float32 values instead of text. "
+                             "The app on the board must expect this format.")
     args = parser.parse_args()
 
+    data, labels = pd_get_data(args.data_file)
     DataProviderClient(
-        data_sequence=pd_get_data(args.data_file),
+        data=data,
+        labels=labels,
         time_step=args.time_step,
         port=args.board_port,
-        board_ip=args.board_ip).send_all(args.stop_after)
+        board_ip=args.board_ip,
+        binary=args.binary).send_all(args.stop_after)
 
 
 if __name__ == '__main__':